@@ -1,32 +1,36 @@
 import streamlit as st
 import asyncio
-import sys
-from pathlib import Path
-from typing import Dict, Any
+import uvloop
+import threading
+import queue
+from typing import Dict, Any, Final
 import logging
-import tempfile
-import os
-
-# Add src to path
-src_path = Path(__file__).parent / "src"
-sys.path.insert(0, str(src_path))
+import re
+from concurrent.futures import ThreadPoolExecutor
 
 from src.agent import MathExpertWithMemory
-from utils.image_to_text import get_text_from_image
+from src.utils.image_to_text import get_text_from_image
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Configure logging once per session - basicConfig still walks the
+# handler list on every rerun even when it ends up a no-op
+if "_logging_configured" not in st.session_state:
+    logging.basicConfig(level=logging.INFO)
+    st.session_state._logging_configured = True
 logger = logging.getLogger(__name__)
 
-# Configure Streamlit page
-st.set_page_config(
-    page_title="Mathematics Expert",
-    page_icon="∫",
-    layout="wide"
-)
+# Configure Streamlit page (must stay the first element call; swallow
+# the duplicate-call error if the page is already configured)
+try:
+    st.set_page_config(
+        page_title="Mathematics Expert",
+        page_icon="∫",
+        layout="wide"
+    )
+except st.errors.StreamlitAPIException:
+    pass
 
 # --- THEME AND LAYOUT CSS ---
-st.markdown("""
+_CSS: Final[str] = """
 <style>
     /* === Base Theme === */
     .stApp {
@@ -122,7 +126,16 @@ st.markdown("""
         display: inline-block;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# st.html skips the markdown parse + unsafe_allow_html escape checks,
+# and the Final constant keeps the payload a single stable string object
+st.html(_CSS)
+
+# Use uvloop's libuv-backed event loop for faster async I/O (LLM streaming, tool calls)
+if "uvloop_installed" not in st.session_state:
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    st.session_state.uvloop_installed = True
 
 # --- Session State Initialization ---
 if "expert" not in st.session_state:
@@ -150,8 +163,11 @@ with st.sidebar:
         help="Upload a PNG image of your math problem"
     )
     
+    # Read the upload once; the same bytes feed the preview and OCR below
+    uploaded_image_bytes = None
     if uploaded_file is not None:
-        st.image(uploaded_file, caption="Uploaded Image", use_container_width=True)
+        uploaded_image_bytes = uploaded_file.getvalue()
+        st.image(uploaded_image_bytes, caption="Uploaded Image", use_container_width=True)
         
     st.markdown("---")
     
@@ -161,7 +177,8 @@ with st.sidebar:
         st.session_state.messages = [
             {"role": "assistant", "content": "👋 Welcome to the Mathematics Expert! I can help you solve complex math problems. You can type your question or upload an image of a math problem."}
         ]
-        st.rerun()
+        # No st.rerun() needed - the button click already reran the script,
+        # and the chat history below renders after this state reset
     
     st.markdown("---")
     st.markdown("### Features:")
@@ -172,11 +189,17 @@ with st.sidebar:
     st.markdown("• Image problem solving")
 
 # --- Core Functions ---
+@st.cache_resource
+def _get_expert() -> MathExpertWithMemory:
+    """Build the expert once per process and share it across sessions."""
+    expert = MathExpertWithMemory()
+    expert.create_agent()
+    return expert
+
 def initialize_expert():
     try:
         if not st.session_state.initialized:
-            st.session_state.expert = MathExpertWithMemory()
-            st.session_state.expert.create_agent()
+            st.session_state.expert = _get_expert()
             st.session_state.initialized = True
             logger.info("Expert initialized successfully")
         return True
@@ -185,119 +208,138 @@ def initialize_expert():
         st.error(f"Failed to initialize expert: {e}")
         return False
 
-def run_async_query(query: str) -> Dict[str, Any]:
-    """Runs an async query in a sync context."""
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-
-    result = loop.run_until_complete(
-        st.session_state.expert.handle_math_query_with_memory(  
-            query=query, session_id=st.session_state.current_session_id, user_id="streamlit_user"
-        )
-    )
+@st.cache_resource
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    """Start a long-lived background loop shared by all queries."""
+    loop = uvloop.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def run_async_query(query: str, placeholder) -> Dict[str, Any]:
+    """Runs an async query in a sync context, streaming output into a placeholder."""
+    # Drive the stream on the background loop so the LLM client keeps a
+    # stable, long-lived loop (and warm connection pools) across chat
+    # turns; events are handed back to the script thread via a queue so
+    # the placeholder updates as tokens arrive instead of after the
+    # full generation.
+    # Read session state here on the script thread - the background
+    # loop thread has no ScriptRunContext and would see an empty state.
+    expert = st.session_state.expert
+    session_id = st.session_state.current_session_id
+    events: queue.Queue = queue.Queue()
+
+    async def _drive():
+        try:
+            async for event in expert.stream_math_query_with_memory(
+                query=query, session_id=session_id, user_id="streamlit_user"
+            ):
+                events.put(event)
+        finally:
+            events.put(None)
+
+    future = asyncio.run_coroutine_threadsafe(_drive(), _get_background_loop())
+
+    result = {}
+    streamed_chars = 0
+    while True:
+        event = events.get()
+        if event is None:
+            break
+        kind, payload = event
+        if kind == "delta":
+            # The agent's structured output streams as raw JSON, so the
+            # deltas aren't displayable text; show live progress instead
+            streamed_chars += len(payload)
+            placeholder.markdown(f"🧠 Thinking... ({streamed_chars:,} characters generated)")
+        elif kind == "result":
+            result = payload
+
+    # Re-raise anything _drive itself died on instead of dropping it
+    future.result()
+
     if result.get("success"):
         st.session_state.current_session_id = result.get("session_id")
     return result
 
-def process_uploaded_image(uploaded_file) -> str:
-    """Process uploaded image and extract text."""
-    tmp_file_path = None
+# Dedicated pool for OCR so the blocking vision-API call runs off the
+# script/event-loop threads and can overlap with LLM streaming
+@st.cache_resource
+def _get_ocr_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=2)
+
+def process_uploaded_image(image_bytes: bytes) -> str:
+    """Process uploaded image bytes and extract text. Runs on the OCR pool."""
     try:
-        # Create a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_file:
-            tmp_file.write(uploaded_file.getbuffer())
-            tmp_file_path = tmp_file.name
-
-        # Extract text from image
-        extracted_text = get_text_from_image(tmp_file_path)
-        return extracted_text
-        
+        # Hand the uploaded bytes straight to OCR - no temp file round-trip
+        return get_text_from_image(image_bytes)
     except Exception as e:
         return f"Error processing image: {str(e)}"
-    finally:
-        # Ensure temporary file is always deleted
-        if tmp_file_path and os.path.exists(tmp_file_path):
-            try:
-                os.unlink(tmp_file_path)
-                logger.info(f"Temporary image file deleted: {tmp_file_path}")
-            except Exception as cleanup_error:
-                logger.warning(f"Failed to delete temporary file {tmp_file_path}: {cleanup_error}")
+
+# Compiled once so each response is rewritten in a single pass instead of
+# chained str.replace scans over the full text
+_SOLUTION_PAT = re.compile(r"\. |=> |Set ")
+_SOLUTION_MAP = {". ": ".\n\n", "=> ": "\n\n**➤** ", "Set ": "\n**Step:** Set "}
+_EXPLANATION_PAT = re.compile(r": |, ")
+_EXPLANATION_MAP = {": ": ":\n\n", ", ": ",\n"}
+_SECTION_SEPARATOR = "\n\n---\n\n"
+
+# Per-section body formatters for the table-driven dispatch below
+def _fmt_text(value: str) -> str:
+    return value
+
+def _fmt_solution(value: str) -> str:
+    # Clean up the step-by-step solution for better readability
+    return _SOLUTION_PAT.sub(lambda m: _SOLUTION_MAP[m.group(0)], value)
+
+def _fmt_explanation(value: str) -> str:
+    # Format the explanation for better readability
+    return _EXPLANATION_PAT.sub(lambda m: _EXPLANATION_MAP[m.group(0)], value)
+
+def _fmt_methods(value) -> str:
+    return "\n\n".join(f"**Method {i}:** {method}" for i, method in enumerate(value, 1))
+
+def _fmt_formulas(value) -> str:
+    return "\n".join(f"```\n{formula}\n```" for formula in value)
+
+def _fmt_mistakes(value) -> str:
+    return "\n\n".join(f"**{i}.** {mistake}" for i, mistake in enumerate(value, 1))
+
+def _fmt_topics(value) -> str:
+    return " • ".join(value)
+
+_RESPONSE_SECTIONS = [
+    ("problem_analysis", "🔍 Problem Analysis", _fmt_text),
+    ("step_by_step_solution", "📝 Step-by-Step Solution", _fmt_solution),
+    ("concept_explanation", "💡 Concept Explanation", _fmt_explanation),
+    ("alternative_methods", "🔄 Alternative Methods", _fmt_methods),
+    ("key_formulas_used", "📐 Key Formulas Used", _fmt_formulas),
+    ("common_mistakes_to_avoid", "⚠️ Common Mistakes to Avoid", _fmt_mistakes),
+    ("related_jee_topics", "🔗 Related Math Topics", _fmt_topics),
+]
 
 def format_math_response(response) -> str:
     """Format the structured response into a readable format with better spacing and organization."""
-    formatted_parts = []
-    
-    if response.problem_analysis:
-        formatted_parts.append(f"""
-### 🔍 Problem Analysis
-{response.problem_analysis}
-""")
-    
-    if response.step_by_step_solution:
-        # Clean up the step-by-step solution for better readability
-        solution = response.step_by_step_solution
-        # Add line breaks for better formatting
-        solution = solution.replace('. ', '.\n\n')
-        solution = solution.replace('=> ', '\n\n**➤** ')
-        solution = solution.replace('Set ', '\n**Step:** Set ')
-        
-        formatted_parts.append(f"""
-### 📝 Step-by-Step Solution
-{solution}
-""")
-
-    if response.concept_explanation:
-        explanation = response.concept_explanation
-        # Format the explanation for better readability
-        explanation = explanation.replace(': ', ':\n\n')
-        explanation = explanation.replace(', ', ',\n')
-        
-        formatted_parts.append(f"""
-### 💡 Concept Explanation
-{explanation}
-""")
-
-    if response.alternative_methods and any(response.alternative_methods):
-        methods = []
-        for i, method in enumerate(response.alternative_methods, 1):
-            methods.append(f"**Method {i}:** {method}")
-        methods_text = "\n\n".join(methods)
-        formatted_parts.append(f"""
-### 🔄 Alternative Methods
-{methods_text}
-""")
-
-    if response.key_formulas_used and any(response.key_formulas_used):
-        formulas = []
-        for formula in response.key_formulas_used:
-            formulas.append(f"```\n{formula}\n```")
-        formulas_text = "\n".join(formulas)
-        formatted_parts.append(f"""
-### 📐 Key Formulas Used
-{formulas_text}
-""")
-    
-    if response.common_mistakes_to_avoid and any(response.common_mistakes_to_avoid):
-        mistakes = []
-        for i, mistake in enumerate(response.common_mistakes_to_avoid, 1):
-            mistakes.append(f"**{i}.** {mistake}")
-        mistakes_text = "\n\n".join(mistakes)
-        formatted_parts.append(f"""
-### ⚠️ Common Mistakes to Avoid
-{mistakes_text}
-""")
-        
-    if response.related_jee_topics and any(response.related_jee_topics):
-        topics = " • ".join(response.related_jee_topics)
-        formatted_parts.append(f"""
-### 🔗 Related Math Topics
-{topics}
-""")
-    
-    return "\n\n---\n\n".join(formatted_parts)
+    out = []
+    for attr, title, fmt in _RESPONSE_SECTIONS:
+        value = getattr(response, attr, None)
+        if not value or (isinstance(value, list) and not any(value)):
+            continue
+        if out:
+            out.append(_SECTION_SEPARATOR)
+        out.append(f"\n### {title}\n")
+        out.append(fmt(value))
+        out.append("\n")
+    return "".join(out)
+
+# Kick off OCR the moment an image lands: the upload itself triggers a
+# rerun, so the vision-API round-trip overlaps with the user typing
+# their question instead of running inside the submit handler
+if uploaded_image_bytes is not None:
+    if st.session_state.get("_ocr_key") != uploaded_file.file_id:
+        st.session_state._ocr_key = uploaded_file.file_id
+        st.session_state._ocr_future = _get_ocr_pool().submit(
+            process_uploaded_image, uploaded_image_bytes
+        )
 
 # --- Main App ---
 st.title("Mathematics Expert")
@@ -310,10 +352,16 @@ if not st.session_state.initialized:
         else:
             st.error("Failed to initialize the math expert. Please refresh the page.")
 
-# Display chat messages
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
+# Display chat messages inside a fragment so interactions scoped to it
+# don't replay the whole script, and the active turn below can render
+# without re-emitting every historical bubble
+@st.fragment
+def render_history():
+    for message in st.session_state.messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+
+render_history()
 
 # Chat input
 if prompt := st.chat_input("Type your math question here..."):
@@ -325,10 +373,10 @@ if prompt := st.chat_input("Type your math question here..."):
     final_query = ""
     has_image = False
     
-    # Process image if uploaded
-    if uploaded_file is not None:
+    # Process image if uploaded (joins the OCR started at upload time)
+    if uploaded_image_bytes is not None:
         with st.spinner("📷 Extracting question from image..."):
-            extracted_text = process_uploaded_image(uploaded_file)
+            extracted_text = st.session_state._ocr_future.result()
             final_query = extracted_text
             has_image = True
             # Clear the uploaded file after processing
@@ -348,25 +396,26 @@ if prompt := st.chat_input("Type your math question here..."):
         with st.chat_message("user"):
             st.markdown(user_content)
         
-        # Get AI response
+        # Get AI response, streamed into the chat bubble as it generates
         with st.chat_message("assistant"):
-            with st.spinner("🧠 Thinking..."):
-                result = run_async_query(final_query)
-                
-                if result and result.get("success"):
-                    response = result.get("structured_response")
-                    if response:
-                        formatted_response = format_math_response(response)
-                        st.markdown(formatted_response)
-                        st.session_state.messages.append({"role": "assistant", "content": formatted_response})
-                    else:
-                        error_msg = "I received an empty response. Could you please try rephrasing your question?"
-                        st.markdown(error_msg)
-                        st.session_state.messages.append({"role": "assistant", "content": error_msg})
+            placeholder = st.empty()
+            placeholder.markdown("🧠 Thinking...")
+            result = run_async_query(final_query, placeholder)
+
+            if result and result.get("success"):
+                response = result.get("structured_response")
+                if response:
+                    formatted_response = format_math_response(response)
+                    placeholder.markdown(formatted_response)
+                    st.session_state.messages.append({"role": "assistant", "content": formatted_response})
                 else:
-                    error_msg = f"❌ **Error:** {result.get('error', 'Unknown error occurred')}"
-                    st.markdown(error_msg)
+                    error_msg = "I received an empty response. Could you please try rephrasing your question?"
+                    placeholder.markdown(error_msg)
                     st.session_state.messages.append({"role": "assistant", "content": error_msg})
+            else:
+                error_msg = f"❌ **Error:** {result.get('error', 'Unknown error occurred')}"
+                placeholder.markdown(error_msg)
+                st.session_state.messages.append({"role": "assistant", "content": error_msg})
     else:
         st.warning("Please provide a question or upload an image.")
 
@@ -1,17 +1,23 @@
 import asyncio
+import datetime
 import logging
+import time
 import uuid
-from typing import  Optional, Dict, Any
+from collections import OrderedDict
+from typing import  Optional, Dict, Any, AsyncIterator, Tuple
+from openai.types.responses import ResponseTextDeltaEvent
 from agents import (
     Agent, 
     Runner, 
     InputGuardrailTripwireTriggered,
     OutputGuardrailTripwireTriggered
 )
-from tools.rag_search import rag_search
-from tools.web_search import web_search
-from utils.langfuse_config import configure_langfuse
-from utils.guardrails import (
+from src.tools.rag_search import rag_search
+from src.tools.web_search import web_search
+from src.tools.combined_search import knowledge_search
+from src.tools.loop_detector import reset_detectors
+from src.utils.langfuse_config import configure_langfuse
+from src.utils.guardrails import (
     MathExpertResponse,
     math_input_guardrail_simple,
     math_output_guardrail_simple
@@ -30,19 +36,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class MathExpertWithMemory:
-    """Math Expert Agent"""
-    
-    def __init__(self):
-        self.agent = None
-        self.sessions = {}  
-        self.memory_enabled = False  
-        
-    def create_agent(self):
-        
-        self.agent = Agent(
-            name="Math Expert",
-            instructions="""
+def _fmt_ts(ts: float) -> str:
+    """Render a stored session timestamp for display"""
+    return datetime.datetime.fromtimestamp(ts).isoformat()
+
+# Static system prompt, interned once at import so every run reuses the
+# same prompt-cache-friendly prefix
+_INSTRUCTIONS = """
             You are a Math expert coach.
             
             Your mission: Help to solve math problems/concepts through clear, comprehensive teaching.
@@ -61,13 +61,15 @@ class MathExpertWithMemory:
                - The problem involves very recent mathematical developments
                - You need current exam patterns or latest techniques
                - The query is about modern applications or tools
-            4. Review conversation history if provided for context
-            5. Provide comprehensive solutions
-            
+            4. If you already know you need both sources, call knowledge_search - it runs rag_search and web_search together in a single call
+            5. Review conversation history if provided for context
+            6. Provide comprehensive solutions
+
             TOOL USAGE GUIDELINES:
             - Start with rag_search for all mathematical concepts
             - Only call web_search if rag_search results are insufficient
             - If rag_search provides complete information, skip web_search
+            - Prefer one knowledge_search call over separate rag_search then web_search calls when both are needed
             
             RESPONSE STRUCTURE:
             - Problem Analysis: Break down the question
@@ -91,9 +93,77 @@ class MathExpertWithMemory:
             
             Remember: You're training future engineers. Maintain high standards while being accessible.
             Remember: Always end the conversation with a question seeking for user's feedback. You have to ask a question to the user.
-            """,
+
+            Each query arrives with its session metadata and conversation history inline.
+            Provide a comprehensive response using the tools as directed above, and if the
+            user refers to "previous problem", "from earlier", or similar context, use the
+            conversation history provided with the query.
+            """
+
+class TTLOrderedDict(OrderedDict):
+    """Session store bounded by entry count and idle TTL.
+
+    The oldest session is evicted once maxsize is exceeded; lookups
+    refresh recency and drop entries whose last_activity is stale, so a
+    long-running server can't leak memory linearly in traffic.
+    """
+
+    def __init__(self, maxsize: int = 5000, ttl_seconds: int = 86400):
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+
+    def _expired(self, value) -> bool:
+        last = value.get("last_activity")
+        if not isinstance(last, (int, float)):
+            return False
+        return time.time() - last > self.ttl_seconds
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if self._expired(value):
+            super().__delitem__(key)
+            raise KeyError(key)
+        self.move_to_end(key)
+        return value
+
+    def __contains__(self, key):
+        if not super().__contains__(key):
+            return False
+        if self._expired(super().__getitem__(key)):
+            super().__delitem__(key)
+            return False
+        return True
+
+    def sweep_expired(self):
+        """Drop expired sessions from the least-recently-used end."""
+        for key in list(self.keys()):
+            if self._expired(super().__getitem__(key)):
+                super().__delitem__(key)
+            else:
+                break
+
+class MathExpertWithMemory:
+    """Math Expert Agent"""
+
+    def __init__(self):
+        self.agent = None
+        self.sessions = TTLOrderedDict(maxsize=5000, ttl_seconds=86400)
+        self.memory_enabled = False
+        
+    def create_agent(self):
+        
+        self.agent = Agent(
+            name="Math Expert",
+            instructions=_INSTRUCTIONS,
             model="o4-mini",  # Using o4-mini for orchestration
-            tools=[rag_search, web_search],
+            tools=[knowledge_search, rag_search, web_search],
             input_guardrails=[math_input_guardrail_simple],
             output_guardrails=[math_output_guardrail_simple],
             output_type=MathExpertResponse,
@@ -105,17 +175,16 @@ class MathExpertWithMemory:
     
     def get_or_create_session(self, session_id: Optional[str] = None, user_id: str = "default_user") -> str:
         """Get existing session or create new one"""
+        self.sessions.sweep_expired()
         if session_id and session_id in self.sessions:
-            import datetime
-            self.sessions[session_id]["last_activity"] = datetime.datetime.now().isoformat()
+            self.sessions[session_id]["last_activity"] = time.time()
             self.sessions[session_id]["total_queries"] += 1
             logger.info(f"Using existing session: {session_id}")
             return session_id
         else:
             new_session_id = self.generate_session_id()
-            import datetime
-            now = datetime.datetime.now().isoformat()
-            
+            now = time.time()
+
             self.sessions[new_session_id] = {
                 "session_id": new_session_id,
                 "user_id": user_id,
@@ -127,111 +196,145 @@ class MathExpertWithMemory:
             
             return new_session_id
     
-    def add_to_conversation_history(self, session_id: str, query: str, response: str):
-        """Add query-response pair to conversation history"""
+    # Rough character budget for rendered history (~2000 tokens of prefill)
+    HISTORY_CHAR_BUDGET = 8000
+
+    def add_to_conversation_history(self, session_id: str, query: str, response):
+        """Add a compact record of the exchange to conversation history"""
         if session_id in self.sessions:
             self.sessions[session_id]["conversation_history"].append({
                 "query": query,
-                "response": response,
-                "timestamp": str(uuid.uuid4())[:8]
+                # Terse per-turn summary from the structured fields instead
+                # of the full formatted response blob
+                "summary": f"{response.problem_analysis[:200]} | {response.step_by_step_solution[:300]}",
+                "solution": response.step_by_step_solution,
+                "timestamp": time.time()
             })
             # Keep only last 3 exchanges to avoid context overflow
             if len(self.sessions[session_id]["conversation_history"]) > 3:
                 self.sessions[session_id]["conversation_history"] = self.sessions[session_id]["conversation_history"][-3:]
-    
+
     def get_conversation_context(self, session_id: str) -> str:
         """Get formatted conversation history for context"""
         if session_id not in self.sessions or not self.sessions[session_id]["conversation_history"]:
             return "No previous conversation in this session."
-        
-        context = "CONVERSATION HISTORY:\n"
-        for i, exchange in enumerate(self.sessions[session_id]["conversation_history"], 1):
-            context += f"\nPREVIOUS QUERY {i}: {exchange['query']}\n"
-            context += f"PREVIOUS RESPONSE {i} (Summary): {exchange['response'][:500]}...\n"
-        
-        return context
+
+        history = self.sessions[session_id]["conversation_history"]
+
+        # Older turns as one-line summaries, the most recent turn with its
+        # full solution, all capped by a hard character budget
+        lines = []
+        for i, exchange in enumerate(history[:-1], 1):
+            lines.append(f"\nPREVIOUS QUERY {i}: {exchange['query']}\n")
+            lines.append(f"PREVIOUS RESPONSE {i} (Summary): {exchange['summary']}\n")
+
+        recent = history[-1]
+        lines.append(f"\nPREVIOUS QUERY {len(history)}: {recent['query']}\n")
+        lines.append(f"PREVIOUS RESPONSE {len(history)}: {recent['solution'][:3000]}\n")
+
+        # Evict oldest lines until the rendered history fits the budget
+        while len(lines) > 2 and sum(map(len, lines)) > self.HISTORY_CHAR_BUDGET:
+            del lines[:2]
+
+        return "CONVERSATION HISTORY:\n" + "".join(lines)
     
-    async def handle_math_query_with_memory(self, query: str, session_id: Optional[str] = None, user_id: str = "default_user") -> Dict[str, Any]:
-        """Handle a math query"""
+    async def stream_math_query_with_memory(self, query: str, session_id: Optional[str] = None, user_id: str = "default_user") -> AsyncIterator[Tuple[str, Any]]:
+        """Handle a math query, streaming output as it is generated.
+
+        Yields ("delta", text) tuples while the model produces output, then a
+        final ("result", dict) carrying the same payload that
+        handle_math_query_with_memory returns.
+        """
         try:
+            # Loop detection is about repeats within one run; clear the
+            # windows so calls from earlier turns (or other sessions
+            # sharing this expert) can't trip them
+            reset_detectors()
+
             current_session_id = self.get_or_create_session(session_id, user_id)
             
             # Get conversation context
             conversation_context = self.get_conversation_context(current_session_id)
             
-            # Enhanced query with session context and conversation history
-            enhanced_query = f"""
-            Session ID: {current_session_id}
-            Memory Status: disabled (fallback mode)
-            Query #{self.sessions[current_session_id]['total_queries']}
-            
-            {conversation_context}
-            
-            CURRENT USER QUERY: {query}
+            # Enhanced query: only the dynamic pieces - session metadata,
+            # history, and the query itself. The static boilerplate lives
+            # in _INSTRUCTIONS so more of the prompt prefix is cacheable.
+            enhanced_query = (
+                f"Session ID: {current_session_id}\n"
+                f"Memory Status: disabled (fallback mode)\n"
+                f"Query #{self.sessions[current_session_id]['total_queries']}\n\n"
+                f"{conversation_context}\n\n"
+                f"CURRENT USER QUERY: {query}"
+            )
             
-            Please provide a comprehensive response using rag_search and web_search.
-            If the user refers to "previous problem", "from earlier", or similar context, use the conversation history above.
-            """
-            
-            # Run the agent
-            result = await Runner.run(self.agent, enhanced_query)
-            response = result.final_output
+            # Run the agent, forwarding raw output text deltas as they arrive
+            streamed = Runner.run_streamed(self.agent, enhanced_query)
+            async for event in streamed.stream_events():
+                if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+                    yield "delta", event.data.delta
+            response = streamed.final_output
             
             # Ensure session_id is set
             response.session_id = current_session_id
-            
-            # Handle missing fields with defaults
-            if not hasattr(response, 'memory_insights') or not response.memory_insights:
-                response.memory_insights = "Memory system not available - using session context"
-            
-            if not hasattr(response, 'personalized_tips') or not response.personalized_tips:
-                response.personalized_tips = "Focus on practice and concept clarity for success"
-            
-            # Format response
-            formatted_response = f"""
-
-                Memory Status: disabled (using session context)
-                Query #{self.sessions[current_session_id]['total_queries']}
-
-                PROBLEM ANALYSIS:
-                {response.problem_analysis}
-
-                CONCEPT EXPLANATION:
-                {response.concept_explanation}
-
-                STEP-BY-STEP SOLUTION:
-                {response.step_by_step_solution}
 
-                ALTERNATIVE METHODS:
-                {chr(10).join(f"Method {i+1}: {method}" for i, method in enumerate(response.alternative_methods)) if response.alternative_methods else "Standard method provided above"}
+            # Format response: flat parts list + one join, no nested
+            # chr(10) expressions re-evaluated inside a giant f-string
+            parts = [
+                "Memory Status: disabled (using session context)",
+                f"Query #{self.sessions[current_session_id]['total_queries']}",
+                "",
+                "PROBLEM ANALYSIS:",
+                response.problem_analysis,
+                "",
+                "CONCEPT EXPLANATION:",
+                response.concept_explanation,
+                "",
+                "STEP-BY-STEP SOLUTION:",
+                response.step_by_step_solution,
+                "",
+                "ALTERNATIVE METHODS:",
+            ]
+            if response.alternative_methods:
+                parts.extend(f"Method {i+1}: {method}" for i, method in enumerate(response.alternative_methods))
+            else:
+                parts.append("Standard method provided above")
 
-                KEY FORMULAS USED:
-                {chr(10).join(f"• {formula}" for formula in response.key_formulas_used) if response.key_formulas_used else "• Basic math formulas"}
+            parts += ["", "KEY FORMULAS USED:"]
+            if response.key_formulas_used:
+                parts.extend(f"• {formula}" for formula in response.key_formulas_used)
+            else:
+                parts.append("• Basic math formulas")
 
-                COMMON MISTAKES TO AVOID:
-                {chr(10).join(f"• {mistake}" for mistake in response.common_mistakes_to_avoid) if response.common_mistakes_to_avoid else "• Calculation errors and sign mistakes"}
+            parts += ["", "COMMON MISTAKES TO AVOID:"]
+            if response.common_mistakes_to_avoid:
+                parts.extend(f"• {mistake}" for mistake in response.common_mistakes_to_avoid)
+            else:
+                parts.append("• Calculation errors and sign mistakes")
 
-                RELATED TOPICS:
-                {', '.join(response.related_jee_topics) if response.related_jee_topics else "Math fundamentals"}
-
-                DIFFICULTY LEVEL: {response.difficulty_level}
-                ESTIMATED TIME TO SOLVE: {response.time_to_solve_minutes} minutes
-
-                PRACTICE RECOMMENDATIONS:
-                {response.practice_recommendations}
-
-                MEMORY INSIGHTS:
-                {response.memory_insights}
-
-                PERSONALIZED TIPS:
-                {response.personalized_tips}
-                {'='*70}
-            """
+            parts += [
+                "",
+                "RELATED TOPICS:",
+                ', '.join(response.related_jee_topics) if response.related_jee_topics else "Math fundamentals",
+                "",
+                f"DIFFICULTY LEVEL: {response.difficulty_level}",
+                f"ESTIMATED TIME TO SOLVE: {response.time_to_solve_minutes} minutes",
+                "",
+                "PRACTICE RECOMMENDATIONS:",
+                response.practice_recommendations,
+                "",
+                "MEMORY INSIGHTS:",
+                response.memory_insights,
+                "",
+                "PERSONALIZED TIPS:",
+                response.personalized_tips,
+                "=" * 70,
+            ]
+            formatted_response = "\n".join(parts)
             
             # Add to conversation history for future context
-            self.add_to_conversation_history(current_session_id, query, formatted_response)
+            self.add_to_conversation_history(current_session_id, query, response)
             
-            return {
+            yield "result", {
                 "success": True,
                 "session_id": current_session_id,
                 "response": formatted_response.strip(),
@@ -245,7 +348,7 @@ class MathExpertWithMemory:
         except InputGuardrailTripwireTriggered as e:
             error_msg = "INPUT REJECTED: Please ask math questions only."
             logger.warning(f"Input guardrail triggered: {e}")
-            return {
+            yield "result", {
                 "success": False,
                 "error": error_msg,
                 "session_id": session_id,
@@ -255,7 +358,7 @@ class MathExpertWithMemory:
         except OutputGuardrailTripwireTriggered as e:
             error_msg = "OUTPUT QUALITY CHECK FAILED: Response didn't meet standards. Please try rephrasing."
             logger.warning(f"Output guardrail triggered: {e}")
-            return {
+            yield "result", {
                 "success": False,
                 "error": error_msg,
                 "session_id": session_id,
@@ -265,13 +368,21 @@ class MathExpertWithMemory:
         except Exception as e:
             error_msg = f"SYSTEM ERROR: {str(e)}"
             logger.error(f"Error handling query: {e}")
-            return {
+            yield "result", {
                 "success": False,
                 "error": error_msg,
                 "session_id": session_id,
                 "error_type": "system_error"
             }
 
+    async def handle_math_query_with_memory(self, query: str, session_id: Optional[str] = None, user_id: str = "default_user") -> Dict[str, Any]:
+        """Handle a math query"""
+        result: Dict[str, Any] = {}
+        async for kind, payload in self.stream_math_query_with_memory(query, session_id, user_id):
+            if kind == "result":
+                result = payload
+        return result
+
 async def main():
     # Simplified testing function
     expert = MathExpertWithMemory()
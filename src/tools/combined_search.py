@@ -0,0 +1,37 @@
+import asyncio
+import logging
+from typing import Dict
+
+from agents import function_tool
+
+from src.tools.rag_search import rag_search_impl
+from src.tools.web_search import web_search_impl
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+@function_tool
+async def knowledge_search(query: str) -> Dict:
+    """
+    Search the math knowledge base and the web in parallel with one call.
+
+    Args:
+        query: The math question or concept to look up
+
+    Returns:
+        Dictionary with 'rag_results' from the vector store and
+        'web_results' from the web search
+    """
+    logger.info(f"Knowledge search for: {query}")
+
+    # Both searches are independent I/O - run them concurrently so the
+    # agent spends one tool call instead of two serialized ones
+    rag_results, web_results = await asyncio.gather(
+        rag_search_impl(query),
+        web_search_impl([query]),
+    )
+
+    return {
+        "rag_results": [result.model_dump() for result in rag_results],
+        "web_results": web_results,
+    }
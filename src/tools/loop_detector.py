@@ -0,0 +1,41 @@
+import hashlib
+import json
+from collections import deque
+from typing import List
+
+# Every detector registers itself here so the agent can reset them all
+# at the start of each run; without that the sliding window would span
+# separate turns (and, with one shared expert, separate users)
+_DETECTORS: List["LoopDetector"] = []
+
+def reset_detectors():
+    """Clear every registered detector's window (call once per agent run)."""
+    for detector in _DETECTORS:
+        detector.reset()
+
+class LoopDetector:
+    """Detects repeated identical tool invocations in a sliding window.
+
+    Agents in a ReAct loop sometimes re-issue the exact same tool call
+    when the model is uncertain; each repeat costs a full LLM iteration.
+    Tools record every invocation and short-circuit once the same
+    call shows up too often in the recent window.
+    """
+
+    def __init__(self, window: int = 5, max_repeats: int = 2):
+        self.window = window
+        self.max_repeats = max_repeats
+        self._recent: deque = deque(maxlen=window)
+        _DETECTORS.append(self)
+
+    def reset(self):
+        """Forget recorded invocations so a fresh run starts clean."""
+        self._recent.clear()
+
+    def record(self, tool_name: str, args: dict) -> bool:
+        """Record an invocation; True if it looks like a loop."""
+        key = hashlib.md5(
+            f"{tool_name}:{json.dumps(args, sort_keys=True)}".encode()
+        ).hexdigest()
+        self._recent.append(key)
+        return self._recent.count(key) > self.max_repeats
@@ -1,12 +1,21 @@
 import os
+import asyncio
 import logging
-from typing import List
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional
+import httpx
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
 from qdrant_client import AsyncQdrantClient
-from qdrant_client.models import ScoredPoint
+from qdrant_client.models import (
+    QuantizationSearchParams,
+    ScoredPoint,
+    SearchParams,
+)
 from pydantic import BaseModel
 from agents import function_tool
+from src.tools.loop_detector import LoopDetector
 
 # Load environment variables
 load_dotenv()
@@ -18,13 +27,76 @@ QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 COLLECTION_NAME = "math-content"
 EMBEDDING_MODEL = "text-embedding-3-small"
 
-# Initialize clients
-openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
-qdrant_client = AsyncQdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
+# Lazy client singletons: constructing async clients at import time
+# binds their machinery to whatever loop exists (or none) and breaks in
+# multi-loop setups; defer construction to first use inside the loop
+_openai_client: Optional[AsyncOpenAI] = None
+_qdrant_client: Optional[AsyncQdrantClient] = None
+
+def get_openai_client() -> AsyncOpenAI:
+    global _openai_client
+    if _openai_client is None:
+        # Pooled HTTP/2 transport so repeat tool calls reuse warm
+        # keep-alive connections instead of re-handshaking
+        _openai_client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            http_client=httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=300),
+            ),
+        )
+    return _openai_client
+
+def get_qdrant_client() -> AsyncQdrantClient:
+    global _qdrant_client
+    if _qdrant_client is None:
+        # gRPC keeps a persistent channel and encodes vectors as protobuf
+        # floats instead of JSON text - far fewer wire bytes per search
+        _qdrant_client = AsyncQdrantClient(
+            url=QDRANT_URL,
+            api_key=QDRANT_API_KEY,
+            timeout=10,
+            prefer_grpc=True,
+            grpc_port=6334,
+        )
+    return _qdrant_client
 
 # Logging
 logger = logging.getLogger(__name__)
 
+class AsyncTTLCache:
+    """Bounded in-process cache with LRU eviction and per-entry TTL."""
+
+    def __init__(self, maxsize: int = 512, ttl_seconds: float = 600.0):
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._maxsize = maxsize
+        self._ttl = ttl_seconds
+        self._lock = asyncio.Lock()
+
+    async def get(self, key: Any) -> Optional[Any]:
+        async with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self._ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    async def set(self, key: Any, value: Any):
+        async with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            if len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+# ReAct loops often re-issue the same (or near-identical) query; cache
+# embeddings and search hits so repeats skip the OpenAI + Qdrant trips
+embedding_cache = AsyncTTLCache(maxsize=512, ttl_seconds=600)
+rag_result_cache = AsyncTTLCache(maxsize=512, ttl_seconds=600)
+
 class RAGSearchResult(BaseModel):
     """Search result from Qdrant"""
     content_id: str
@@ -36,31 +108,48 @@ class RAGSearchResult(BaseModel):
 
 async def generate_embedding(text: str) -> List[float]:
     try:
-        response = await openai_client.embeddings.create(
+        cache_key = text.strip().lower()
+        cached = await embedding_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        response = await get_openai_client().embeddings.create(
             model=EMBEDDING_MODEL,
             input=text
         )
-        return response.data[0].embedding
+        embedding = response.data[0].embedding
+        await embedding_cache.set(cache_key, embedding)
+        return embedding
     except Exception as e:
         logger.error(f"Embedding error: {e}")
         raise
 
-@function_tool
-async def rag_search(query: str, num_chunks: int = 4) -> List[RAGSearchResult]:
+async def rag_search_impl(query: str, num_chunks: int = 4) -> List[RAGSearchResult]:
     try:
         if not query.strip():
             raise ValueError("Query cannot be empty")
 
         num_chunks = max(1, min(num_chunks, 10))
 
+        cache_key = (query.strip().lower(), num_chunks)
+        cached = await rag_result_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"RAG cache hit for: {query}")
+            return cached
+
         logger.info(f"Searching Qdrant for: {query}")
         query_embedding = await generate_embedding(query)
 
-        search_results: List[ScoredPoint] = await qdrant_client.search(
+        search_results: List[ScoredPoint] = await get_qdrant_client().search(
             collection_name=COLLECTION_NAME,
             query_vector=query_embedding,
             limit=num_chunks,
             score_threshold=0.3,
+            # Score candidates on the int8 copies, rescore the survivors
+            # with full-precision vectors to preserve recall
+            search_params=SearchParams(
+                quantization=QuantizationSearchParams(rescore=True, oversampling=2.0)
+            ),
         )
 
         # Log what was retrieved
@@ -86,8 +175,24 @@ async def rag_search(query: str, num_chunks: int = 4) -> List[RAGSearchResult]:
             logger.info(f"  Problem: {result.problem[:100]}...")
             logger.info(f"  Solution: {result.solution[:100]}...")
 
+        await rag_result_cache.set(cache_key, results)
         return results
 
     except Exception as e:
         logger.error(f"RAG search failed: {e}")
         return []
+
+_loop_detector = LoopDetector()
+
+@function_tool
+async def rag_search(query: str, num_chunks: int = 4) -> List[RAGSearchResult]:
+    """Search the math content vector store for relevant problems and solutions."""
+    if _loop_detector.record("rag_search", {"query": query, "num_chunks": num_chunks}):
+        logger.warning(f"Repeated identical rag_search detected, short-circuiting: {query}")
+        # Serve the cached results from the earlier identical call rather
+        # than an empty list; fall through if the cache entry expired
+        cache_key = (query.strip().lower(), max(1, min(num_chunks, 10)))
+        cached = await rag_result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    return await rag_search_impl(query, num_chunks)
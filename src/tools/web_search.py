@@ -1,9 +1,12 @@
+import asyncio
 import logging
 import os
 import httpx
+import orjson
 from typing import List, Dict
 from dotenv import load_dotenv
 from agents import function_tool
+from src.tools.loop_detector import LoopDetector
 
 # Load environment variables
 load_dotenv()
@@ -13,17 +16,71 @@ TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 # Set up logging
 logger = logging.getLogger(__name__)
 
-@function_tool
-async def web_search(queries: List[str]) -> Dict:
-    """
-    Search the web for information using Tavily API.
-    
-    Args:
-        queries: List of search queries to run
-        
-    Returns:
-        Dictionary containing search results
-    """
+# Cap on concurrent Tavily requests to stay under their rate limits
+MAX_CONCURRENT_SEARCHES = 8
+
+async def _search_one(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, query: str) -> Dict:
+    """Run a single Tavily search and return its result dict."""
+    async with semaphore:
+        logger.info(f"Web searching for: {query}")
+        try:
+            # Use Tavily directly rather than going through MCP
+            search_payload = {
+                "api_key": TAVILY_API_KEY,
+                "query": query,
+                "search_depth": "advanced",
+                "include_answer": True,
+                "include_domains": ["*.edu", "*.org", "*.gov", "wikipedia.org", "mathworld.wolfram.com", "brilliant.org", "khanacademy.org"],
+                "max_results": 5
+            }
+
+            response = await client.post(
+                "https://api.tavily.com/search",
+                json=search_payload
+            )
+
+            if response.status_code != 200:
+                logger.warning(f"Tavily API error: {response.status_code} - {response.text}")
+                return {
+                    "error": f"API error: {response.status_code}",
+                    "search_results": [],
+                    "citations": [],
+                    "result_count": 0
+                }
+
+            result_data = orjson.loads(response.content)
+
+            # Log what was retrieved
+            logger.info(f"Found {len(result_data.get('results', []))} web results")
+
+            # Process and log results
+            search_results = result_data.get("results", [])
+            for i, result in enumerate(search_results[:3]):  # Log first 3 results
+                logger.info(f"Web Result {i+1}: {result.get('title', 'No title')}")
+                logger.info(f"  Source: {result.get('url', 'No URL')}")
+                logger.info(f"  Content: {result.get('content', 'No content')[:100]}...")
+
+            return {
+                "summary": f"Found {len(search_results)} sources for '{query}'",
+                "search_results": search_results,
+                "citations": [
+                    {"title": r.get("title", ""), "url": r.get("url", "")}
+                    for r in search_results
+                ],
+                "result_count": len(search_results),
+                "answer": result_data.get("answer", "")
+            }
+
+        except Exception as e:
+            logger.error(f"Web search error for query '{query}': {str(e)}")
+            return {
+                "error": str(e),
+                "search_results": [],
+                "citations": [],
+                "result_count": 0
+            }
+
+async def web_search_impl(queries: List[str]) -> Dict:
     if not queries:
         logger.warning("No search queries provided")
         return {
@@ -40,69 +97,27 @@ async def web_search(queries: List[str]) -> Dict:
             "results": {}
         }
     
-    results = {}
-    
+    # Fan out all queries concurrently over one pooled client - total
+    # latency becomes that of the slowest single search, not the sum
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_SEARCHES)
     async with httpx.AsyncClient(timeout=30.0) as client:
-        for query in queries:
-            logger.info(f"Web searching for: {query}")
-            try:
-                # Use Tavily directly rather than going through MCP
-                search_payload = {
-                    "api_key": TAVILY_API_KEY,
-                    "query": query,
-                    "search_depth": "advanced",
-                    "include_answer": True,
-                    "include_domains": ["*.edu", "*.org", "*.gov", "wikipedia.org", "mathworld.wolfram.com", "brilliant.org", "khanacademy.org"],
-                    "max_results": 5
-                }
-                
-                response = await client.post(
-                    "https://api.tavily.com/search",
-                    json=search_payload
-                )
-                
-                if response.status_code != 200:
-                    logger.warning(f"Tavily API error: {response.status_code} - {response.text}")
-                    results[query] = {
-                        "error": f"API error: {response.status_code}",
-                        "search_results": [],
-                        "citations": [],
-                        "result_count": 0
-                    }
-                    continue
-                
-                result_data = response.json()
-                
-                # Log what was retrieved
-                logger.info(f"Found {len(result_data.get('results', []))} web results")
-                
-                # Process and log results
-                search_results = result_data.get("results", [])
-                for i, result in enumerate(search_results[:3]):  # Log first 3 results
-                    logger.info(f"Web Result {i+1}: {result.get('title', 'No title')}")
-                    logger.info(f"  Source: {result.get('url', 'No URL')}")
-                    logger.info(f"  Content: {result.get('content', 'No content')[:100]}...")
-                
-                results[query] = {
-                    "summary": f"Found {len(search_results)} sources for '{query}'",
-                    "search_results": search_results,
-                    "citations": [
-                        {"title": r.get("title", ""), "url": r.get("url", "")}
-                        for r in search_results
-                    ],
-                    "result_count": len(search_results),
-                    "answer": result_data.get("answer", "")
-                }
-                
-            except Exception as e:
-                logger.error(f"Web search error for query '{query}': {str(e)}")
-                results[query] = {
-                    "error": str(e),
-                    "search_results": [],
-                    "citations": [],
-                    "result_count": 0
-                }
-    
+        query_results = await asyncio.gather(
+            *[_search_one(client, semaphore, query) for query in queries],
+            return_exceptions=True
+        )
+
+    results = {}
+    for query, result in zip(queries, query_results):
+        if isinstance(result, BaseException):
+            logger.error(f"Web search error for query '{query}': {result}")
+            result = {
+                "error": str(result),
+                "search_results": [],
+                "citations": [],
+                "result_count": 0
+            }
+        results[query] = result
+
     return {
         "status": "success",
         "metadata": {
@@ -110,3 +125,25 @@ async def web_search(queries: List[str]) -> Dict:
         },
         "results": results
     }
+
+_loop_detector = LoopDetector()
+
+@function_tool
+async def web_search(queries: List[str]) -> Dict:
+    """
+    Search the web for information using Tavily API.
+
+    Args:
+        queries: List of search queries to run
+
+    Returns:
+        Dictionary containing search results
+    """
+    if _loop_detector.record("web_search", {"queries": queries}):
+        logger.warning(f"Repeated identical web_search detected, short-circuiting: {queries}")
+        return {
+            "status": "error",
+            "error": "These exact queries were already searched - reuse the earlier results instead of searching again",
+            "results": {}
+        }
+    return await web_search_impl(queries)
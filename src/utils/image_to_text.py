@@ -1,21 +1,48 @@
 import anthropic
 import base64
+import io
+from PIL import Image
 
-def get_text_from_image(image_path: str) -> str:
+# Build the client once on first use and reuse it across uploads so
+# each OCR call keeps the same HTTP connection pool; constructing it
+# lazily keeps a missing ANTHROPIC_API_KEY a per-upload error instead
+# of an import-time crash
+_anthropic_client = None
+
+def get_client() -> anthropic.Anthropic:
+    global _anthropic_client
+    if _anthropic_client is None:
+        _anthropic_client = anthropic.Anthropic()
+    return _anthropic_client
+
+# Claude vision resizes anything larger than this server-side anyway,
+# so uploading full-resolution screenshots just wastes upload time
+MAX_IMAGE_DIM = 1568
+
+def downscale_if_large(image_bytes: bytes) -> bytes:
+    """Downscale full-page screenshots so the long edge fits MAX_IMAGE_DIM."""
+    img = Image.open(io.BytesIO(image_bytes))
+    if max(img.size) <= MAX_IMAGE_DIM:
+        return image_bytes
+    img.thumbnail((MAX_IMAGE_DIM, MAX_IMAGE_DIM))
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def get_text_from_image(image_bytes: bytes) -> str:
     """
     Extracts text of a math question from an image using Anthropic's Claude.
 
     Args:
-        image_path: The file path to the image.
+        image_bytes: The raw PNG bytes of the image.
 
     Returns:
         The extracted text of the question.
     """
     try:
-        with open(image_path, "rb") as image_file:
-            image_data = base64.b64encode(image_file.read()).decode("utf-8")
+        image_data = base64.b64encode(downscale_if_large(image_bytes)).decode("utf-8")
 
-        message = anthropic.Anthropic().messages.create(
+        message = get_client().messages.create(
             model="claude-opus-4-20250514",
             max_tokens=1024,
             messages=[
@@ -49,6 +76,6 @@ def get_text_from_image(image_path: str) -> str:
 
 # Test the function if run directly
 if __name__ == '__main__':
-    image_path = "img.png"
-    result = get_text_from_image(image_path)
+    with open("img.png", "rb") as f:
+        result = get_text_from_image(f.read())
     print(result)
\ No newline at end of file
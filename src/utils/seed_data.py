@@ -1,12 +1,22 @@
 import os
-import json
+import orjson
 import uuid
+import asyncio
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
-from typing import List
+from typing import List, Optional
 from dotenv import load_dotenv
-from openai import OpenAI
-from qdrant_client import QdrantClient
-from qdrant_client.models import PointStruct
+from openai import AsyncOpenAI
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import (
+    Distance,
+    PointStruct,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    VectorParams,
+)
 
 # Load environment variables
 load_dotenv()
@@ -14,15 +24,30 @@ load_dotenv()
 # Configuration
 ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../dataset"))
 EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 1536
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 COLLECTION_NAME = "math-content"
-BATCH_SIZE = 100
+# Large batches amortize HTTP overhead; the embeddings API accepts up
+# to 2048 inputs per request but also caps ~300k tokens per request,
+# so batches are bounded by both
+BATCH_SIZE = 2048
+MAX_BATCH_TOKENS = 250_000
+# Batches allowed in flight at once, so embedding and upserting of
+# different batches overlap their network waits
+MAX_IN_FLIGHT = 8
 
 # Initialize clients
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
-qdrant_client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
+openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+# gRPC matters most here: upsert throughput is serialization-bound and
+# protobuf encodes the embedding floats in a fraction of the JSON bytes
+qdrant_client = AsyncQdrantClient(
+    url=QDRANT_URL,
+    api_key=QDRANT_API_KEY,
+    prefer_grpc=True,
+    grpc_port=6334,
+)
 
 def read_all_json_paths(root_dir: str) -> List[str]:
     all_json_files = []
@@ -32,71 +57,168 @@ def read_all_json_paths(root_dir: str) -> List[str]:
                 all_json_files.append(os.path.join(subdir, file))
     return all_json_files
 
+def _parse_one(path: str) -> Optional[dict]:
+    """Parse and validate one dataset file; None if invalid or unreadable."""
+    try:
+        with open(path, "rb") as f:
+            data = orjson.loads(f.read())
+
+        problem = data.get("problem", "").strip()
+        solution = data.get("solution", "").strip()
+        if not problem or not solution:
+            return None
+
+        # Content-addressed ID: re-running the seeder maps unchanged
+        # documents to the same point instead of re-inserting them
+        content_id = str(uuid.UUID(
+            hashlib.blake2b((problem + solution).encode(), digest_size=16).hexdigest()
+        ))
+
+        return {
+            "id": content_id,
+            "text": f"{problem}\nSolution: {solution}",
+            "payload": {
+                "content_id": content_id,
+                "solution": solution,
+                "problem": problem,
+                "section": data.get("type", os.path.basename(os.path.dirname(path))),
+                "difficulty_level": data.get("level", ""),
+            }
+        }
+
+    except Exception as e:
+        print(f" Skipped {path}: {e}")
+        return None
+
 def load_valid_data(file_paths: List[str]) -> List[dict]:
-    all_data = []
-    for path in file_paths:
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-
-            problem = data.get("problem", "").strip()
-            solution = data.get("solution", "").strip()
-            if not problem or not solution:
-                continue
-
-            all_data.append({
-                "id": str(uuid.uuid4()),
-                "text": f"{problem}\nSolution: {solution}",
-                "payload": {
-                    "content_id": str(uuid.uuid4()),
-                    "solution": solution,
-                    "problem": problem,
-                    "section": data.get("type", os.path.basename(os.path.dirname(path))),
-                    "difficulty_level": data.get("level", ""),
-                }
-            })
-
-        except Exception as e:
-            print(f" Skipped {path}: {e}")
-    return all_data
-
-def batch(iterable, batch_size):
-    """Yield successive batch-sized chunks from iterable"""
-    for i in range(0, len(iterable), batch_size):
-        yield iterable[i:i + batch_size]
-
-def embed_and_upload(data_batch: List[dict]):
+    # json.loads across thousands of independent files is CPU-bound and
+    # embarrassingly parallel - spread it over all cores
+    with ProcessPoolExecutor() as executor:
+        results = list(tqdm(
+            executor.map(_parse_one, file_paths, chunksize=64),
+            total=len(file_paths)
+        ))
+    return [item for item in results if item is not None]
+
+def _estimate_tokens(text: str) -> int:
+    """Rough token estimate (~4 chars/token for English math text)."""
+    return len(text) // 4 + 1
+
+def batch(data: List[dict], batch_size: int):
+    """Yield chunks bounded by both item count and estimated tokens.
+
+    The embeddings API rejects requests over ~300k tokens regardless of
+    how few inputs they contain, so item count alone is not a safe cap.
+    """
+    current: List[dict] = []
+    current_tokens = 0
+    for item in data:
+        item_tokens = _estimate_tokens(item["text"])
+        if current and (
+            len(current) >= batch_size
+            or current_tokens + item_tokens > MAX_BATCH_TOKENS
+        ):
+            yield current
+            current = []
+            current_tokens = 0
+        current.append(item)
+        current_tokens += item_tokens
+    if current:
+        yield current
+
+async def embed_and_upload(data_batch: List[dict]) -> bool:
     try:
-        texts = [item["text"] for item in data_batch]
-        response = openai_client.embeddings.create(
+        # Skip documents already indexed under their content-addressed IDs
+        existing = await qdrant_client.retrieve(
+            collection_name=COLLECTION_NAME,
+            ids=[item["id"] for item in data_batch],
+            with_payload=False,
+            with_vectors=False,
+        )
+        existing_ids = {str(point.id) for point in existing}
+        data_batch = [item for item in data_batch if item["id"] not in existing_ids]
+        if not data_batch:
+            return True
+
+        # Scraped corpora repeat problems; embed each distinct text once
+        # and fan the vector back out to every duplicate in the batch
+        digests = [
+            hashlib.blake2b(item["text"].encode(), digest_size=16).digest()
+            for item in data_batch
+        ]
+        unique = {}
+        texts = []
+        for digest, item in zip(digests, data_batch):
+            if digest not in unique:
+                unique[digest] = len(texts)
+                texts.append(item["text"])
+
+        response = await openai_client.embeddings.create(
             model=EMBEDDING_MODEL,
             input=texts
         )
         embeddings = [res.embedding for res in response.data]
 
         points = []
-        for i, item in enumerate(data_batch):
+        for digest, item in zip(digests, data_batch):
             points.append(PointStruct(
                 id=item["id"],
-                vector=embeddings[i],
+                vector=embeddings[unique[digest]],
                 payload=item["payload"]
             ))
 
-        qdrant_client.upsert(
+        await qdrant_client.upsert(
             collection_name=COLLECTION_NAME,
             points=points
         )
+        return True
 
     except Exception as e:
         print(f"Batch failed: {e}")
+        return False
+
+async def ensure_collection():
+    """Create the collection with int8 scalar quantization if missing.
+
+    Int8 copies score ~4x faster and take a quarter of the RAM of fp32;
+    queries rescore the top candidates with full precision (see rag_search).
+    """
+    if not await qdrant_client.collection_exists(COLLECTION_NAME):
+        await qdrant_client.create_collection(
+            collection_name=COLLECTION_NAME,
+            vectors_config=VectorParams(size=EMBEDDING_DIM, distance=Distance.COSINE),
+            quantization_config=ScalarQuantization(
+                scalar=ScalarQuantizationConfig(
+                    type=ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True,
+                )
+            ),
+        )
 
-def main():
-   
+async def main():
+
+    # Parse first, then touch the network: load_valid_data forks worker
+    # processes, and forking with a live gRPC channel is unsupported
     file_paths = read_all_json_paths(ROOT_DIR)
     all_data = load_valid_data(file_paths)
-    
-    for data_batch in tqdm(batch(all_data, BATCH_SIZE), total=(len(all_data) // BATCH_SIZE + 1)):
-        embed_and_upload(data_batch)
+
+    await ensure_collection()
+
+    semaphore = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+    async def run_batch(data_batch: List[dict]) -> bool:
+        async with semaphore:
+            return await embed_and_upload(data_batch)
+
+    tasks = [asyncio.create_task(run_batch(b)) for b in batch(all_data, BATCH_SIZE)]
+    failures = 0
+    for task in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+        if not await task:
+            failures += 1
+
+    if failures:
+        raise SystemExit(f"{failures}/{len(tasks)} batches failed to embed or upload")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())